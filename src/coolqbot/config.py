@@ -34,3 +34,8 @@ COMMAND_START = {'/'}
 
 GROUP_ID = list(map(int, config['bot']['group_id'].split()))
 IS_COOLQ_PRO = config.getboolean('bot', 'is_coolq_pro')
+
+# 缓存文件夹，可以设置到 tmpfs 上加快读写，默认与数据放在一起
+CACHE_DIR_PATH = Path(
+    config.get('bot', 'cache_dir', fallback='') or DATA_DIR_PATH
+)
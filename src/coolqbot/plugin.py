@@ -1,9 +1,17 @@
 """ 插件相关
 """
+import asyncio
 import configparser
+import functools
+import io
+import os
 import pickle
+import stat
+import threading
 
-from .config import DATA_DIR_PATH
+import diskcache
+
+from .config import CACHE_DIR_PATH, DATA_DIR_PATH
 
 
 class PluginData:
@@ -12,10 +20,12 @@ class PluginData:
     将插件数据保存在 `data` 文件夹对应的目录下。
     提供保存和读取文件/数据的方法。
     """
-    def __init__(self, name, config=False):
+    def __init__(self, name, config=False, cache=False):
         # 插件名，用来确定插件的文件夹位置
         self._name = name
         self._base_path = DATA_DIR_PATH / f'plugin-{name}'
+        # 字符串形式的路径，拼接时比 Path 更快
+        self._base_str = str(self._base_path)
 
         # 如果文件夹不存在则自动新建
         if not DATA_DIR_PATH.exists():
@@ -31,41 +41,116 @@ class PluginData:
                 self._load_config()
             else:
                 self._save_config()
+            # 异步写入配置时保证按顺序写入，第一次使用时再创建
+            self._config_lock = None
+            # 常用配置的快照，读取时不用每次都经过 configparser
+            self._snapshot = {
+                section: dict(self.config.items(section))
+                for section in self.config.sections()
+            }
+
+        # 如果需要则初始化缓存
+        # 缓存保存在同一个 SQLite 数据库中，不用每个键值都单独开一个文件
+        # 缓存可以重新获取，所以关闭 SQLite 的同步写入
+        if cache:
+            cache_path = CACHE_DIR_PATH / f'plugin-{name}' / 'cache'
+            self._cache = diskcache.Cache(
+                str(cache_path), sqlite_synchronous=0
+            )
 
     def save_pkl(self, data, filename):
-        with self.open(f'{filename}.pkl', 'wb') as f:
-            pickle.dump(data, f)
+        content = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        self._write(f'{filename}.pkl', content, 'wb')
+
+    async def save_pkl_async(self, data, filename):
+        """ 在线程池中写入 pkl 文件，不阻塞事件循环
+
+        序列化仍在事件循环中进行，避免写入时数据被同时修改
+        """
+        content = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            None, self._write, f'{filename}.pkl', content, 'wb'
+        )
 
     def load_pkl(self, filename):
         with self.open(f'{filename}.pkl', 'rb') as f:
             data = pickle.load(f)
         return data
 
-    def config_get(self, section, option, fallback=''):
+    def cache_get(self, key, default=None):
+        """ 获得缓存
+
+        如果缓存不存在则返回 `default`
+        """
+        return self._cache.get(key, default)
+
+    def cache_set(self, key, value, expire=None):
+        """ 设置缓存
+
+        `expire` 为过期的秒数，默认永不过期
+        """
+        self._cache.set(key, value, expire=expire)
+
+    async def cache_set_async(self, key, value, expire=None):
+        """ 在线程池中设置缓存，不阻塞事件循环
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            None, functools.partial(self.cache_set, key, value, expire=expire)
+        )
+
+    def config_get(self, section, option, fallback='', save=True):
         """ 获得配置
 
-        如果配置不存在则使用 `fallback` 并保存
+        如果配置不存在则使用 `fallback` 并保存，`save` 为 False 时不保存
 
         如果不提供 `fallback` 默认返回空字符串
         """
-        try:
-            value = self.config.get(section, option)
-        except (configparser.NoSectionError, configparser.NoOptionError):
-            value = fallback
-            # 保存默认配置
-            if section not in self.config.sections():
-                self.config[section] = {}
-            self.config.set(section, option, fallback)
-            self._save_config()
-        return value
+        options = self._snapshot.get(section, {})
+        value = options.get(self.config.optionxform(option))
+        if value is not None:
+            return value
+
+        if self.config.has_option(section, option):
+            return self.config.get(section, option)
+
+        # 保存默认配置
+        if save:
+            self.config_set(section, option, fallback)
+        return fallback
 
     def config_set(self, section, option, value):
         """ 设置配置
         """
+        self._update_config(section, option, value)
+        self._save_config()
+
+    async def config_set_async(self, section, option, value):
+        """ 设置配置，并在线程池中写入文件，不阻塞事件循环
+        """
+        self._update_config(section, option, value)
+        # 在事件循环中生成内容，避免写入时配置被同时修改
+        content = self._dump_config()
+        if self._config_lock is None:
+            self._config_lock = asyncio.Lock()
+        async with self._config_lock:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(
+                None, self._write, self._config_path, content, 'w'
+            )
+
+    def _update_config(self, section, option, value):
+        """ 更新内存中的配置
+        """
         if section not in self.config.sections():
             self.config[section] = {}
         self.config.set(section, option, value)
-        self._save_config()
+        # 同时更新快照
+        options = self._snapshot.setdefault(section, {})
+        options[self.config.optionxform(option)] = self.config.get(
+            section, option
+        )
 
     def _load_config(self):
         """ 读取配置
@@ -75,15 +160,46 @@ class PluginData:
     def _save_config(self):
         """ 保存配置
         """
-        with self.open(self._config_path, 'w') as configfile:
+        self._write(self._config_path, self._dump_config(), 'w')
+
+    def _dump_config(self):
+        """ 将配置转换成字符串
+        """
+        with io.StringIO() as configfile:
             self.config.write(configfile)
+            return configfile.getvalue()
+
+    def _write(self, filename, content, open_mode):
+        """ 写入文件
+
+        先写入临时文件再替换，避免读到只写了一半的文件
+        不调用 fsync，由系统决定何时写入硬盘
+        """
+        path = os.path.join(self._base_str, filename)
+        # 每个线程使用不同的临时文件，在线程池中同时写入也不会冲突
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            # 新文件的权限与直接 open 时一样由 umask 决定
+            fd = os.open(
+                tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666
+            )
+            with os.fdopen(fd, open_mode) as f:
+                # 已有文件则保留原来的权限，避免保存 Token 的文件被公开
+                if os.path.exists(path):
+                    os.fchmod(fd, stat.S_IMODE(os.stat(path).st_mode))
+                f.write(content)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
 
     def open(self, filename, open_mode='r'):
-        path = self._base_path / filename
+        path = os.path.join(self._base_str, filename)
         return open(path, open_mode)
 
     def exists(self, filename):
         """ 判断文件是否存在
         """
-        path = self._base_path / filename
-        return path.exists()
+        path = os.path.join(self._base_str, filename)
+        return os.path.exists(path)
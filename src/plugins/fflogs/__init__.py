@@ -22,6 +22,10 @@ SECOND = int(API.data.config_get('cache', 'second', fallback='0'))
 async def fflogs_cache():
     """ 定时缓存数据
     """
+    # 没有 Token 时无法获取数据
+    if not API.token:
+        return
+
     for (boss_id, difficulty), boss_nickname in boss_list.items():
         for job_id, job_nickname in job_list.items():
             await API.dps(boss_nickname[0], job_nickname[0])
@@ -29,13 +33,20 @@ async def fflogs_cache():
             await asyncio.sleep(30)
 
 
+@bot.get_bot().server_app.after_serving
+async def fflogs_close():
+    """ 关闭时释放连接
+    """
+    await API.close()
+
+
 @on_command('dps', aliases=['输出'], only_to_me=False, shell_like=True)
 async def dps(session: CommandSession):
     """ 查询 DPS
     """
     # 设置 Token
     if session.argv[0] == 'token' and len(session.argv) == 2:
-        API.token = session.argv[1]
+        await API.set_token(session.argv[1])
         session.finish('Token 设置完成。')
 
     # 检查 Token 是否设置
@@ -2,69 +2,149 @@
 
 文档网址 https://cn.fflogs.com/v1/docs
 """
-import json
+import asyncio
 import math
+from collections import OrderedDict
 from datetime import datetime, timedelta
 
 import aiohttp
+import numpy as np
+import orjson
 
 from coolqbot import PluginData
 
 from .data import get_boss_info, get_job_name
 from .exceptions import AuthException, DataException
 
+# DPS 类型与对应的数据字段
+DPS_KEYS = {
+    'rdps': 'total',
+    'adps': 'other_per_second_amount',
+    'pdps': 'raw_dps',
+}
+# 需要计算的百分比，以及从高到低排序时对应的位置比例
+PERCENTILES = [100, 99, 95, 75, 50, 25, 10]
+PERC_FRACS = [(100 - perc) * 0.01 for perc in PERCENTILES]
+
 
 class FFLogs:
     def __init__(self):
         self.base_url = 'https://cn.fflogs.com/v1'
-        self.data = PluginData('fflogs', config=True)
+        self.data = PluginData('fflogs', config=True, cache=True)
 
         # 默认从两周的数据中计算排名百分比
         self.range = int(self.data.config_get('fflogs', 'range', '14'))
+        # 每次请求都需要 Token，读取一次后保存下来
+        # 没有设置时为 None，不写入默认值
+        self._token = self.data.config_get(
+            'fflogs', 'token', fallback=None, save=False
+        )
+
+        # 限制同时获取数据的天数，避免请求过于频繁
+        # 需要在事件循环中创建，所以第一次使用时再创建
+        self._semaphore = None
+
+        # 复用同一个会话，避免每次请求都重新建立连接
+        self._session = None
+
+        # 内存中的排名数据缓存，超过上限时丢弃最久未使用的数据
+        self._ranking_cache = OrderedDict()
+        self._ranking_cache_size = 512
 
     @property
     def token(self):
-        try:
-            return self.data.config_get('fflogs', 'token')
-        except:
-            return None
+        return self._token
+
+    async def set_token(self, token):
+        """ 设置 Token
+        """
+        self._token = token
+        await self.data.config_set_async('fflogs', 'token', token)
 
-    @token.setter
-    def token(self, token):
-        self.data.config_set('fflogs', 'token', token)
+    def _get_semaphore(self):
+        """ 获取限制同时获取数据天数的信号量
 
-    async def _http(self, url, is_json=True, headers=None):
+        第一次调用时创建，之后复用
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(8)
+        return self._semaphore
+
+    def _get_session(self):
+        """ 获取会话
+
+        第一次调用时创建，之后复用
+        """
+        if not self._session or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=16, ttl_dns_cache=300, keepalive_timeout=60
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        """ 关闭会话
+        """
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _http(self, url, is_json=True, headers=None, params=None):
         try:
             # 使用 aiohttp 库发送最终的请求
-            async with aiohttp.ClientSession() as sess:
-                async with sess.get(url, headers=headers) as response:
-                    if response.status == 401:
-                        raise AuthException('Token 有误，无法获取数据')
-                    if response.status != 200:
-                        # 如果 HTTP 响应状态码不是 200，说明调用失败
-                        return None
-                    if is_json:
-                        resp_payload = json.loads(await response.text())
-                    else:
-                        resp_payload = await response.text()
-
-                    return resp_payload
-        except (aiohttp.ClientError, json.JSONDecodeError, KeyError):
+            sess = self._get_session()
+            async with sess.get(
+                url, headers=headers, params=params
+            ) as response:
+                if response.status == 401:
+                    raise AuthException('Token 有误，无法获取数据')
+                if response.status != 200:
+                    # 如果 HTTP 响应状态码不是 200，说明调用失败
+                    return None
+                if is_json:
+                    resp_payload = orjson.loads(await response.read())
+                else:
+                    resp_payload = await response.text()
+
+                return resp_payload
+        except (aiohttp.ClientError, orjson.JSONDecodeError, KeyError):
             # 抛出上面任何异常，说明调用失败
             return None
 
+    def _cache_get(self, key):
+        """ 从内存缓存中获取排名数据
+        """
+        if key not in self._ranking_cache:
+            return None
+        self._ranking_cache.move_to_end(key)
+        return self._ranking_cache[key]
+
+    def _cache_set(self, key, rankings):
+        """ 将排名数据放入内存缓存
+        """
+        self._ranking_cache[key] = rankings
+        self._ranking_cache.move_to_end(key)
+        if len(self._ranking_cache) > self._ranking_cache_size:
+            self._ranking_cache.popitem(last=False)
+
     async def _get_one_day_ranking(
         self, boss, difficulty, job, date: datetime
     ):
         """ 获取指定 boss，指定职业，指定一天中的排名数据
         """
-        # 查看是否有缓存
+        # 先查看内存中是否有缓存
+        cache_key = (boss, difficulty, job, date)
+        rankings = self._cache_get(cache_key)
+        if rankings is not None:
+            return rankings
+
+        # 再查看硬盘中是否有缓存
         cache_name = f'{boss}_{difficulty}_{job}_{date.strftime("%Y%m%d")}'
-        if self.data.exists(f'{cache_name}.pkl'):
-            return self.data.load_pkl(cache_name)
+        rankings = self.data.cache_get(cache_name)
+        if rankings is not None:
+            self._cache_set(cache_key, rankings)
+            return rankings
 
-        page = 1
-        hasMorePages = True
         rankings = []
 
         end_date = date + timedelta(days=1)
@@ -72,22 +152,58 @@ class FFLogs:
         start_timestamp = int(date.timestamp()) * 1000
         end_timestamp = int(end_date.timestamp()) * 1000
 
-        while hasMorePages:
-            rankings_url = f'{self.base_url}/rankings/encounter/{boss}?metric=rdps&difficulty={difficulty}&spec={job}&page={page}&filter=date.{start_timestamp}.{end_timestamp}&api_key={self.token}'
-
-            res = await self._http(rankings_url)
-
-            if not res:
-                raise DataException('服务器没有正确返回数据')
+        rankings_url = f'{self.base_url}/rankings/encounter/{boss}'
+        params = {
+            'metric': 'rdps',
+            'difficulty': difficulty,
+            'spec': job,
+            'filter': f'date.{start_timestamp}.{end_timestamp}',
+            'api_key': self.token,
+        }
+
+        async def _fetch_page(page):
+            # 同时获取多页时每页的参数需要分开
+            return await self._http(
+                rankings_url, params={**params, 'page': page}
+            )
 
-            hasMorePages = res['hasMorePages']
-            rankings += res['rankings']
-            page += 1
+        async with self._get_semaphore():
+            page = 1
+            hasMorePages = True
+            results = [await _fetch_page(page)]
+            while hasMorePages:
+                for res in results:
+                    if not res:
+                        raise DataException('服务器没有正确返回数据')
+
+                    hasMorePages = res['hasMorePages']
+                    rankings += res['rankings']
+                    page += 1
+                    # 丢弃最后一页之后多获取的数据
+                    if not hasMorePages:
+                        break
+
+                if hasMorePages:
+                    # 还有更多数据时，同时获取接下来的几页
+                    results = await asyncio.gather(
+                        *[_fetch_page(page + i) for i in range(4)]
+                    )
+
+        # 按不同的 DPS 类型分别保存成数组
+        rankings = {
+            key: np.fromiter(
+                (i[key] for i in rankings),
+                dtype=np.float64,
+                count=len(rankings)
+            )
+            for key in DPS_KEYS.values()
+        }
 
         # 如果获取数据的日期不是当天，则缓存数据
         # 因为今天的数据可能还会增加，不能先缓存
         if end_date < datetime.now():
-            self.data.save_pkl(rankings, cache_name)
+            self._cache_set(cache_key, rankings)
+            await self.data.cache_set_async(cache_name, rankings)
 
         return rankings
 
@@ -96,29 +212,25 @@ class FFLogs:
     ):
         date = datetime(year=date.year, month=date.month, day=date.day)
 
-        rankings = []
-        for _ in range(self.range):
-            rankings += await self._get_one_day_ranking(
-                boss, difficulty, job, date
-            )
-            date -= timedelta(days=1)
-
-        # 根据 DPS 类型进行排序，并提取数据
-        if dps_type == 'rdps':
-            rankings.sort(key=lambda x: x['total'], reverse=True)
-            rankings = [i['total'] for i in rankings]
-
-        if dps_type == 'adps':
-            rankings.sort(
-                key=lambda x: x['other_per_second_amount'], reverse=True
-            )
-            rankings = [i['other_per_second_amount'] for i in rankings]
-
-        if dps_type == 'pdps':
-            rankings.sort(key=lambda x: x['raw_dps'], reverse=True)
-            rankings = [i['raw_dps'] for i in rankings]
-
-        if not rankings:
+        # 每天的数据互不依赖，同时获取
+        dates = [date - timedelta(days=i) for i in range(self.range)]
+        tasks = [
+            asyncio.ensure_future(
+                self._get_one_day_ranking(boss, difficulty, job, d)
+            ) for d in dates
+        ]
+        try:
+            results = await asyncio.gather(*tasks)
+        except Exception:
+            # 有一天获取失败时，取消其他还在获取数据的任务
+            for task in tasks:
+                task.cancel()
+            raise
+        # 只合并需要的 DPS 类型的数据
+        key = DPS_KEYS[dps_type]
+        rankings = np.concatenate([result[key] for result in results])
+
+        if not rankings.size:
             raise DataException('网站里没有数据')
 
         return rankings
@@ -126,15 +238,15 @@ class FFLogs:
     async def zones(self):
         """ 副本
         """
-        url = f'{self.base_url}/zones?api_key={self.token}'
-        data = await self._http(url)
+        url = f'{self.base_url}/zones'
+        data = await self._http(url, params={'api_key': self.token})
         return data
 
     async def classes(self):
         """ 职业
         """
-        url = f'{self.base_url}/classes?api_key={self.token}'
-        data = await self._http(url)
+        url = f'{self.base_url}/classes'
+        data = await self._http(url, params={'api_key': self.token})
         return data
 
     async def dps(self, boss, job, dps_type='rdps'):
@@ -148,7 +260,7 @@ class FFLogs:
         if not job_id:
             return f'找不到 {job} 的数据，请换个名字试试'
 
-        if dps_type not in ['adps', 'rdps', 'pdps']:
+        if dps_type not in DPS_KEYS:
             return f'找不到类型为 {dps_type} 的数据，只支持 adps rdps pdps'
 
         # 排名从前一天开始排，因为今天的数据并不全
@@ -167,10 +279,14 @@ class FFLogs:
         total = len(rankings)
         reply += f'\n数据总数：{total} 条'
         # 计算百分比的 DPS
-        percentage_list = [100, 99, 95, 75, 50, 25, 10]
-        for perc in percentage_list:
-            number = math.floor(total * 0.01 * (100 - perc))
-            dps = float(rankings[number])
+        # 排名是从高到低的，转换成从低到高排序后的位置
+        # 只需要部分排序出这几个位置的数据，不用将所有数据排序
+        kth_list = [
+            total - 1 - math.floor(total * frac) for frac in PERC_FRACS
+        ]
+        rankings = np.partition(rankings, kth_list)
+        for perc, kth in zip(PERCENTILES, kth_list):
+            dps = float(rankings[kth])
             reply += f'\n{perc}% : {dps:.2f}'
 
         return reply
@@ -37,19 +37,26 @@ job_list = {
 } # yapf: disable
 
 
+# 昵称与对应数据，载入时生成一次，查询时不用遍历所有数据
+# 如果昵称重复，则与遍历时一样使用第一个匹配的数据
+boss_nickname_list = {}
+for (boss_id, difficulty), nickname in boss_list.items():
+    for name in nickname:
+        boss_nickname_list.setdefault(name, (boss_id, difficulty, nickname[0]))
+
+job_nickname_list = {}
+for job_id, nickname in job_list.items():
+    for name in nickname:
+        job_nickname_list.setdefault(name, (job_id, nickname[0]))
+
+
 def get_boss_info(name):
     """ 根据昵称获取 boss 的 ID 同时返回正式名称
     """
-    for (boss_id, difficulty), nickname in boss_list.items():
-        if name in nickname:
-            return boss_id, difficulty, nickname[0]
-    return None, None, None
+    return boss_nickname_list.get(name, (None, None, None))
 
 
 def get_job_name(name):
     """ 将中文昵称转换成具体的 ID 同时返回正式名称
     """
-    for job_id, nickname in job_list.items():
-        if name in nickname:
-            return job_id, nickname[0]
-    return None, None
+    return job_nickname_list.get(name, (None, None))
@@ -215,10 +215,10 @@ class Recorder:
             if group_id not in self._msg_number_list:
                 self._msg_number_list[group_id] = {}
 
-    def save_data(self):
+    async def save_data(self):
         """ 保存数据
         """
-        self._data.save_pkl(self.get_data(), self._name)
+        await self._data.save_pkl_async(self.get_data(), self._name)
 
     def get_data(self):
         """ 获取当前数据
@@ -265,4 +265,4 @@ async def save_recorder():
     for group_id in bot.get_bot().config.GROUP_ID:
         recorder.message_number(10, group_id)
 
-    recorder.save_data()
+    await recorder.save_data()